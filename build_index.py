@@ -0,0 +1,135 @@
+import pickle
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Файл с готовым индексом рекомендаций для сервиса
+INDEX_PATH = 'recs_index.pkl'
+
+# Максимальное число персональных рекомендаций, хранимых на пользователя
+MAX_PERSONAL_PER_USER = 100
+# Максимальное число похожих треков, хранимых на трек
+MAX_SIMILAR_PER_TRACK = 50
+
+def top_tracks_frame(keys, tracks, scores, k: int) -> pd.DataFrame:
+    """Сортирует треки по ключу и убыванию score, оставляя top-k на ключ"""
+    grouped = pd.DataFrame({'key': keys, 'track': tracks, 'score': scores})
+    grouped = grouped.sort_values(['key', 'score'], ascending=[True, False])
+    return grouped[grouped.groupby('key').cumcount() < k]
+
+def group_top_tracks(keys, tracks, scores, k: int) -> dict:
+    """Группирует номера треков по ключу, оставляя top-k по убыванию score"""
+    grouped = top_tracks_frame(keys, tracks, scores, k)
+    if grouped.empty:
+        return {}
+
+    # Группы идут подряд: режем общий массив треков по границам ключей
+    group_keys = grouped['key'].to_numpy()
+    starts = np.flatnonzero(group_keys[1:] != group_keys[:-1]) + 1
+    return dict(zip(
+        group_keys[np.r_[0, starts]].tolist(),
+        np.split(grouped['track'].to_numpy(dtype=np.int32), starts)
+    ))
+
+def csr_top_tracks(keys, tracks, scores, k: int, n_keys: int):
+    """
+    Раскладывает top-k треков на каждый номер-ключ в CSR-формат: треки ключа i
+    лежат в ids[offsets[i]:offsets[i + 1]] одним общим int32-массивом
+    """
+    grouped = top_tracks_frame(keys, tracks, scores, k)
+    counts = np.bincount(grouped['key'].to_numpy(dtype=np.int64), minlength=n_keys)
+    offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets, grouped['track'].to_numpy(dtype=np.int32)
+
+def encode_tracks(columns: Dict[str, pd.Series]):
+    """
+    Нумерует track_id из нескольких колонок общим словарём. Каждая колонка
+    сначала факторизуется в своём типе, и в строки переводятся только её
+    уникальные значения, поэтому один трек, записанный в разных колонках
+    числом и строкой, получает один номер
+    """
+    for name, column in columns.items():
+        if column.isna().any():
+            raise ValueError(f"Пустые значения track_id в колонке {name}")
+
+    factorized = [pd.factorize(column) for column in columns.values()]
+    uniques_str = [uniques.astype(str) for _, uniques in factorized]
+    tracks = pd.Index(np.concatenate(uniques_str)).unique()
+
+    int_to_id: List[str] = tracks.tolist()
+    id_to_int: Dict[str, int] = {
+        track_id: track_int for track_int, track_id in enumerate(int_to_id)
+    }
+    codes = [
+        tracks.get_indexer(uniques).astype(np.int32)[column_codes]
+        for (column_codes, _), uniques in zip(factorized, uniques_str)
+    ]
+    return int_to_id, id_to_int, codes
+
+def build_index(personal_recs, similar_tracks, top_popular) -> dict:
+    """Строит структуры, из которых сервис отдаёт рекомендации"""
+    # Переводим track_id в сплошные int32-номера: внутри сервиса работаем
+    # с числами, а в строки переводим только при формировании ответа
+    columns = {
+        'personal_recs.track_id': personal_recs['track_id'],
+        'similar_tracks.track_id': similar_tracks['track_id'],
+        'similar_tracks.similar_track_id': similar_tracks['similar_track_id'],
+        'top_popular.track_id': top_popular['track_id'],
+    }
+    int_to_id, id_to_int, codes = encode_tracks(columns)
+    personal_codes, similar_codes, similar_to_codes, top_popular_codes = codes
+
+    # номер трека -> top-K похожих по убыванию similarity_score
+    similar_offsets, similar_ids = csr_top_tracks(
+        similar_codes,
+        similar_to_codes,
+        similar_tracks['similarity_score'].to_numpy(),
+        MAX_SIMILAR_PER_TRACK,
+        len(int_to_id)
+    )
+
+    return {
+        # user_id -> номера треков по убыванию score. Ключи — строки, как
+        # user_id в запросе к сервису
+        'personal_by_user': group_top_tracks(
+            personal_recs['user_id'].astype(str).to_numpy(),
+            personal_codes,
+            personal_recs['score'].to_numpy(),
+            MAX_PERSONAL_PER_USER
+        ),
+        'similar_offsets': similar_offsets,
+        'similar_ids': similar_ids,
+        # Топ популярных в исходном порядке, непрерывным int32-массивом
+        'top_popular_arr': np.ascontiguousarray(top_popular_codes),
+        'id_to_int': id_to_int,
+        'int_to_id': int_to_id,
+    }
+
+def main():
+    """Читает parquet-файлы рекомендаций и сохраняет индекс для сервиса"""
+    # Читаем только нужные колонки; track_id оставляем в исходном типе
+    personal_recs = pd.read_parquet(
+        'personal_als.parquet', columns=['user_id', 'track_id', 'score']
+    )
+    similar_tracks = pd.read_parquet(
+        'similar.parquet', columns=['track_id', 'similar_track_id', 'similarity_score']
+    )
+    top_popular = pd.read_parquet('top_popular.parquet', columns=['track_id'])
+
+    index = build_index(personal_recs, similar_tracks, top_popular)
+
+    with open(INDEX_PATH, 'wb') as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    logger.info(f"Индекс рекомендаций сохранён в {INDEX_PATH}: "
+                f"{len(index['personal_by_user'])} пользователей, "
+                f"{len(index['similar_ids'])} пар похожих треков")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,42 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-import pandas as pd
 import numpy as np
-from typing import List, Optional
+from numba import njit, types
+from numba.typed import Dict as TypedDict
+from typing import Dict, List, Optional
 import logging
-import boto3
+import pickle
 import os
 from datetime import datetime
+from functools import lru_cache
+from contextlib import asynccontextmanager
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Загружает индекс и компилирует ядра при старте воркера. При запуске
+    с несколькими воркерами процесс-супервизор индекс не загружает
+    """
+    global engine
+    engine = RecommendationEngine(**load_recommendation_data())
+    # Кеш рекомендаций без истории относится к прошлому индексу, если
+    # приложение стартует в процессе повторно (перезагрузка, тесты)
+    recommend_without_history.cache_clear()
+    engine.warm_up()
+    yield
+
 app = FastAPI(
+    lifespan=lifespan,
     title="Music Recommendation Service",
     description="API для выдачи персонализированных рекомендаций треков",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson сериализует списки рекомендаций быстрее стандартного json
+    default_response_class=ORJSONResponse
 )
 
 # Модели данных
@@ -30,73 +51,125 @@ class RecommendationResponse(BaseModel):
     strategy: str
     timestamp: str
 
+# Файл индекса, который собирает build_index.py. Сам модуль build_index
+# не импортируем, чтобы не тянуть pandas при старте сервиса
+INDEX_PATH = 'recs_index.pkl'
+
 # Загрузка данных
 def load_recommendation_data():
-    """Загружает данные рекомендаций"""
+    """Загружает предрассчитанный индекс рекомендаций (см. build_index.py)"""
     try:
-        # Загрузка из локальных файлов
-        personal_recs = pd.read_parquet('personal_als.parquet')
-        similar_tracks = pd.read_parquet('similar.parquet')
-        top_popular = pd.read_parquet('top_popular.parquet')
-        
-        # Преобразуем track_id в строки при загрузке
-        personal_recs['track_id'] = personal_recs['track_id'].astype(str)
-        similar_tracks['track_id'] = similar_tracks['track_id'].astype(str)
-        similar_tracks['similar_track_id'] = similar_tracks['similar_track_id'].astype(str)
-        top_popular['track_id'] = top_popular['track_id'].astype(str)
+        with open(INDEX_PATH, 'rb') as f:
+            index = pickle.load(f)
         
         logger.info("Данные рекомендаций загружены успешно")
-        return personal_recs, similar_tracks, top_popular
     except Exception as e:
         logger.error(f"Ошибка загрузки данных: {e}")
-        # Создаем пустые датафреймы если файлы не найдены
-        return (
-            pd.DataFrame(columns=['user_id', 'track_id', 'score']),
-            pd.DataFrame(columns=['track_id', 'similar_track_id', 'similarity_score']),
-            pd.DataFrame(columns=['track_id', 'popularity_score'])
-        )
+        # Пустой индекс той же структуры, если файл не найден
+        index = {
+            'personal_by_user': {},
+            'similar_offsets': np.zeros(1, dtype=np.int64),
+            'similar_ids': np.empty(0, dtype=np.int32),
+            'top_popular_arr': np.empty(0, dtype=np.int32),
+            'id_to_int': {},
+            'int_to_id': [],
+        }
+    return index
+
+# Пустой массив треков для пользователей и треков, которых нет в индексе
+NO_TRACKS = np.empty(0, dtype=np.int32)
+
+@njit(cache=True)
+def gather_similar(offsets, similar_ids, track_ids, n_per_track):
+    """Собирает до n_per_track похожих треков на каждый трек из track_ids"""
+    out = np.empty(len(track_ids) * n_per_track, dtype=np.int32)
+    size = 0
+    for track in track_ids:
+        start = offsets[track]
+        end = min(offsets[track + 1], start + n_per_track)
+        for i in range(start, end):
+            out[size] = similar_ids[i]
+            size += 1
+    return out[:size]
+
+@njit(cache=True)
+def push_tracks(tracks, seen, out, size):
+    """Дописывает в out ещё не встречавшиеся треки, пока out не заполнен"""
+    for track in tracks:
+        if size == out.shape[0]:
+            break
+        key = np.int64(track)
+        if key not in seen:
+            seen[key] = True
+            out[size] = track
+            size += 1
+    return size
+
+@njit(cache=True)
+def merge_tracks(personal, similar, popular, n_popular, history, n):
+    """
+    Сливает номера треков по приоритету: персональные, похожие, популярные.
+    Дубликаты и треки из истории прослушиваний пропускаются
+    """
+    seen = TypedDict.empty(key_type=types.int64, value_type=types.boolean)
+    for track in history:
+        seen[np.int64(track)] = True
+    
+    out = np.empty(n, dtype=np.int32)
+    size = push_tracks(personal, seen, out, 0)
+    size = push_tracks(similar, seen, out, size)
+    size = push_tracks(popular[:n_popular], seen, out, size)
+    return out[:size]
 
-# Инициализация данных
-personal_recs, similar_tracks, top_popular = load_recommendation_data()
+def writable_array(arr: np.ndarray) -> np.ndarray:
+    """
+    Приводит массив к изменяемому C-массиву. Numba компилирует отдельную
+    специализацию ядра для массивов только для чтения (такими они приходят
+    из pickle), поэтому массивы индекса нормализуем при загрузке
+    """
+    return np.require(arr, requirements=['C', 'W'])
 
 class RecommendationEngine:
-    def __init__(self, personal_recs, similar_tracks, top_popular):
-        self.personal_recs = personal_recs
-        self.similar_tracks = similar_tracks
-        self.top_popular = top_popular
+    def __init__(
+        self,
+        personal_by_user: Dict[str, np.ndarray],
+        similar_offsets: np.ndarray,
+        similar_ids: np.ndarray,
+        top_popular_arr: np.ndarray,
+        id_to_int: Dict[str, int],
+        int_to_id: List[str]
+    ):
+        # Треки внутри движка — int32-номера из индекса
+        # user_id -> номера треков по убыванию score
+        self.personal_by_user = {
+            user_id: writable_array(tracks)
+            for user_id, tracks in personal_by_user.items()
+        }
+        # Похожие треки в CSR-формате: top-K похожих на трек i по убыванию
+        # similarity_score лежат в similar_ids[similar_offsets[i]:similar_offsets[i + 1]]
+        self.similar_offsets = writable_array(similar_offsets)
+        self.similar_ids = writable_array(similar_ids)
+        # Топ популярных: статичный массив, ядро слияния читает его напрямую
+        self.top_popular_arr = writable_array(top_popular_arr)
+        # Отображения track_id <-> номер трека
+        self.id_to_int = id_to_int
+        self.int_to_id = int_to_id
         
-    def get_personal_recommendations(self, user_id: str, n: int = 10) -> List[str]:
-        """Получает персональные рекомендации для пользователя"""
-        user_recs = self.personal_recs[
-            self.personal_recs['user_id'] == user_id
-        ].sort_values('score', ascending=False)
-        
-        if len(user_recs) == 0:
-            return []
-            
-        return user_recs.head(n)['track_id'].tolist()
+    def warm_up(self) -> None:
+        """Компилирует ядра на массивах индекса, чтобы первый запрос не ждал JIT"""
+        self.mix_recommendations('', self.int_to_id[:1], 1)
     
-    def get_similar_tracks(self, track_ids: List[str], n_per_track: int = 3) -> List[str]:
-        """Получает похожие треки на основе истории прослушиваний"""
-        if not track_ids:
-            return []
-            
-        similar_list = []
-        for track_id in track_ids:
-            track_similar = self.similar_tracks[
-                self.similar_tracks['track_id'] == track_id
-            ].sort_values('similarity_score', ascending=False)
-            
-            if len(track_similar) > 0:
-                similar_list.extend(
-                    track_similar.head(n_per_track)['similar_track_id'].tolist()
-                )
-        
-        return similar_list
+    def get_personal_recommendations(self, user_id: str, n: int = 10) -> np.ndarray:
+        """Получает персональные рекомендации для пользователя (номера треков)"""
+        return self.personal_by_user.get(user_id, NO_TRACKS)[:n]
     
-    def get_top_popular(self, n: int = 10) -> List[str]:
-        """Получает топ популярных треков"""
-        return self.top_popular.head(n)['track_id'].tolist()
+    def get_similar_tracks(self, track_ids: np.ndarray, n_per_track: int = 3) -> np.ndarray:
+        """Получает похожие треки на основе истории прослушиваний (номера треков)"""
+        return gather_similar(self.similar_offsets, self.similar_ids, track_ids, n_per_track)
+    
+    def get_top_popular(self, n: int = 10) -> np.ndarray:
+        """Получает топ популярных треков (номера треков)"""
+        return self.top_popular_arr[:n]
     
     def mix_recommendations(
         self, 
@@ -108,60 +181,62 @@ class RecommendationEngine:
         Смешивает онлайн и офлайн рекомендации
         """
         
+        # Переводим онлайн-историю в номера треков; треков, которых нет
+        # в индексе, всё равно не может быть ни среди похожих, ни в выдаче
+        id_to_int = self.id_to_int
+        history_ids = np.array(
+            [id_to_int[track] for track in online_history if track in id_to_int],
+            dtype=np.int32
+        )
+        
         # 1. Персональные рекомендации (офлайн)
         personal = self.get_personal_recommendations(user_id, n_recommendations)
         
-        # 2. Похожие треки на основе онлайн-истории
-        similar_online = self.get_similar_tracks(online_history, n_per_track=2)
-        
-        # 3. Топ популярные (фолбэк)
-        top_popular = self.get_top_popular(n_recommendations * 2)
-        
-        # Объединяем все рекомендации
-        all_recommendations = []
-        
-        # Приоритет 1: Персональные рекомендации
-        all_recommendations.extend(personal)
-        
-        # Приоритет 2: Похожие на онлайн-историю (если есть)
-        if online_history:
-            all_recommendations.extend(similar_online)
-        
-        # Приоритет 3: Топ популярные (если не хватает)
-        if len(all_recommendations) < n_recommendations:
-            additional = [track for track in top_popular 
-                         if track not in all_recommendations]
-            all_recommendations.extend(additional)
-        
-        # Убираем дубликаты, сохраняя порядок
-        seen = set()
-        unique_recommendations = []
-        for track in all_recommendations:
-            if track not in seen:
-                seen.add(track)
-                unique_recommendations.append(track)
-        
-        # Исключаем треки из истории прослушиваний
-        history_set = set(online_history)
-        final_recommendations = [
-            track for track in unique_recommendations 
-            if track not in history_set
-        ]
-        
         # Определяем стратегию
-        if online_history and personal:
+        if online_history and len(personal):
             strategy = "online_history + personal"
         elif online_history:
             strategy = "online_history + top_popular"
-        elif personal:
+        elif len(personal):
             strategy = "personal_only"
         else:
             strategy = "top_popular_only"
         
-        return final_recommendations[:n_recommendations], strategy
+        # 2. Похожие треки на основе онлайн-истории
+        similar_online = self.get_similar_tracks(history_ids, n_per_track=2)
+        
+        # 3. Топ популярные (фолбэк): берём не больше n_recommendations * 2
+        n_popular = min(max(n_recommendations * 2, 0), len(self.top_popular_arr))
+        
+        # Размер выдачи ограничиваем числом кандидатов, а не только запросом
+        # клиента: иначе огромный n_recommendations выделяет огромный буфер
+        n_out = min(
+            max(n_recommendations, 0),
+            len(personal) + len(similar_online) + n_popular
+        )
+        
+        # Объединяем рекомендации по приоритету в скомпилированном ядре
+        recommendations = merge_tracks(
+            personal,
+            similar_online,
+            self.top_popular_arr,
+            n_popular,
+            history_ids,
+            n_out
+        )
+        
+        # В строки track_id переводим только для ответа
+        int_to_id = self.int_to_id
+        return [int_to_id[track] for track in recommendations.tolist()], strategy
 
-# Инициализация движка рекомендаций
-engine = RecommendationEngine(personal_recs, similar_tracks, top_popular)
+# Движок рекомендаций создаётся при старте приложения (см. lifespan)
+engine: Optional[RecommendationEngine] = None
+
+@lru_cache(maxsize=100_000)
+def recommend_without_history(user_id: str, n_recommendations: int) -> tuple[tuple[str, ...], str]:
+    """Рекомендации без онлайн-истории зависят только от пользователя — кешируем их"""
+    recommendations, strategy = engine.mix_recommendations(user_id, [], n_recommendations)
+    return tuple(recommendations), strategy
 
 @app.get("/")
 async def root():
@@ -171,25 +246,33 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+# Обработчик синхронный: FastAPI выполняет его в пуле потоков,
+# и вычисление рекомендаций не блокирует event loop
 @app.post("/recommend", response_model=RecommendationResponse)
-async def get_recommendations(request: RecommendationRequest):
+def get_recommendations(request: RecommendationRequest):
     """Основной endpoint для получения рекомендаций"""
     try:
-        logger.info(f"Получен запрос для user_id: {request.user_id}, "
-                   f"online_history: {len(request.online_history)} треков")
+        # Ленивое форматирование: строка собирается, только если INFO включён
+        logger.info("Получен запрос для user_id: %s, online_history: %d треков",
+                    request.user_id, len(request.online_history))
         
-        recommendations, strategy = engine.mix_recommendations(
-            user_id=request.user_id,
-            online_history=request.online_history,
-            n_recommendations=request.n_recommendations
-        )
+        if request.online_history:
+            recommendations, strategy = engine.mix_recommendations(
+                user_id=request.user_id,
+                online_history=request.online_history,
+                n_recommendations=request.n_recommendations
+            )
+        else:
+            recommendations, strategy = recommend_without_history(
+                request.user_id, request.n_recommendations
+            )
         
-        logger.info(f"Сгенерировано {len(recommendations)} рекомендаций "
-                   f"по стратегии: {strategy}")
+        logger.info("Сгенерировано %d рекомендаций по стратегии: %s",
+                    len(recommendations), strategy)
         
         return RecommendationResponse(
             user_id=request.user_id,
-            recommendations=recommendations,
+            recommendations=list(recommendations),
             strategy=strategy,
             timestamp=datetime.now().isoformat()
         )
@@ -200,4 +283,7 @@ async def get_recommendations(request: RecommendationRequest):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8010)
\ No newline at end of file
+    # Каждый воркер держит собственную копию индекса и кеша рекомендаций,
+    # поэтому по умолчанию воркер один; больше — через WORKERS
+    workers = int(os.getenv("WORKERS", 1))
+    uvicorn.run("recommendations_service:app", host="0.0.0.0", port=8010, workers=workers)
\ No newline at end of file
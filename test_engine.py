@@ -0,0 +1,231 @@
+import asyncio
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from build_index import MAX_PERSONAL_PER_USER, MAX_SIMILAR_PER_TRACK, build_index
+import recommendations_service
+from recommendations_service import RecommendationEngine, gather_similar, merge_tracks
+
+def make_engine(personal_recs, similar_tracks, top_popular):
+    """Собирает движок из небольших датафреймов, как build_index.py"""
+    return RecommendationEngine(**build_index(personal_recs, similar_tracks, top_popular))
+
+@pytest.fixture
+def engine():
+    personal_recs = pd.DataFrame({
+        'user_id': ['u1', 'u1', 'u1', 'u2'],
+        'track_id': [1, 2, 3, 4],
+        'score': [0.9, 0.5, 0.7, 0.8],
+    })
+    similar_tracks = pd.DataFrame({
+        'track_id': [1, 1, 1, 5],
+        'similar_track_id': [6, 7, 2, 1],
+        'similarity_score': [0.3, 0.9, 0.5, 0.4],
+    })
+    top_popular = pd.DataFrame({'track_id': [5, 1, 8, 9]})
+    return make_engine(personal_recs, similar_tracks, top_popular)
+
+@pytest.mark.parametrize("n", [10**6, 10**12, 10**19])
+def test_large_n_returns_all_available_tracks(engine, n):
+    recommendations, strategy = engine.mix_recommendations('u1', ['1'], n)
+    assert recommendations == ['3', '2', '7', '5', '8', '9']
+    assert strategy == "online_history + personal"
+
+def test_warm_up_compiles_the_kernels_used_by_requests(engine):
+    # После pickle массивы индекса доступны только для чтения, как в сервисе
+    personal_recs = pd.DataFrame({'user_id': ['u1'], 'track_id': [1], 'score': [0.5]})
+    similar_tracks = pd.DataFrame({
+        'track_id': [1], 'similar_track_id': [2], 'similarity_score': [0.5],
+    })
+    top_popular = pd.DataFrame({'track_id': [3]})
+    index = pickle.loads(pickle.dumps(
+        build_index(personal_recs, similar_tracks, top_popular), protocol=5
+    ))
+    loaded_engine = RecommendationEngine(**index)
+
+    loaded_engine.warm_up()
+    assert loaded_engine.mix_recommendations('u1', ['1'], 5)[0] == ['2', '3']
+    engine.mix_recommendations('u1', ['1'], 5)
+    assert len(merge_tracks.signatures) == 1
+    assert len(gather_similar.signatures) == 1
+
+def test_restarting_the_app_drops_cached_recommendations(tmp_path, monkeypatch):
+    index_path = tmp_path / 'recs_index.pkl'
+    monkeypatch.setattr(recommendations_service, 'INDEX_PATH', str(index_path))
+
+    async def start_app():
+        async with recommendations_service.lifespan(recommendations_service.app):
+            pass
+
+    similar_tracks = pd.DataFrame(columns=['track_id', 'similar_track_id', 'similarity_score'])
+    for tracks in ([1, 2], [7, 8]):
+        personal_recs = pd.DataFrame({'user_id': ['u1'], 'track_id': [tracks[0]], 'score': [1.0]})
+        top_popular = pd.DataFrame({'track_id': tracks})
+        with open(index_path, 'wb') as f:
+            pickle.dump(build_index(personal_recs, similar_tracks, top_popular), f)
+
+        asyncio.run(start_app())
+        recommendations, _ = recommendations_service.recommend_without_history('u1', 2)
+        assert list(recommendations) == [str(t) for t in tracks]
+
+def test_track_ids_of_different_dtypes_share_one_number():
+    personal_recs = pd.DataFrame({'user_id': ['u1'], 'track_id': [1], 'score': [0.5]})
+    similar_tracks = pd.DataFrame({
+        'track_id': ['1'], 'similar_track_id': ['2'], 'similarity_score': [0.5],
+    })
+    top_popular = pd.DataFrame({'track_id': [2, 1]})
+    index = build_index(personal_recs, similar_tracks, top_popular)
+    assert sorted(index['int_to_id']) == ['1', '2']
+
+    engine = RecommendationEngine(**index)
+    assert engine.mix_recommendations('u2', ['1'], 5)[0] == ['2']
+
+def test_null_track_id_is_rejected():
+    personal_recs = pd.DataFrame({'user_id': ['u1'], 'track_id': [1], 'score': [0.5]})
+    similar_tracks = pd.DataFrame({
+        'track_id': [1], 'similar_track_id': [2], 'similarity_score': [0.5],
+    })
+    top_popular = pd.DataFrame({'track_id': [53404, None]})
+    with pytest.raises(ValueError, match='top_popular.track_id'):
+        build_index(personal_recs, similar_tracks, top_popular)
+
+def test_integer_user_ids_are_looked_up_by_str():
+    personal_recs = pd.DataFrame({
+        'user_id': [101, 101, 202], 'track_id': [1, 2, 3], 'score': [0.1, 0.9, 0.5],
+    })
+    similar_tracks = pd.DataFrame(columns=['track_id', 'similar_track_id', 'similarity_score'])
+    top_popular = pd.DataFrame({'track_id': [3]})
+    engine = make_engine(personal_recs, similar_tracks, top_popular)
+
+    assert engine.mix_recommendations('101', [], 2) == (['2', '1'], "personal_only")
+
+def test_index_keeps_top_k_by_score():
+    scores = np.linspace(0.0, 1.0, 150)
+    personal_recs = pd.DataFrame({
+        'user_id': ['u1'] * 150, 'track_id': np.arange(150), 'score': scores,
+    })
+    similar_tracks = pd.DataFrame({
+        'track_id': [0] * 150, 'similar_track_id': np.arange(150), 'similarity_score': scores,
+    })
+    top_popular = pd.DataFrame({'track_id': [0]})
+    index = build_index(personal_recs, similar_tracks, top_popular)
+    int_to_id = index['int_to_id']
+
+    expected = [str(t) for t in range(149, 149 - MAX_PERSONAL_PER_USER, -1)]
+    assert [int_to_id[t] for t in index['personal_by_user']['u1']] == expected
+
+    offsets, similar_ids = index['similar_offsets'], index['similar_ids']
+    track = index['id_to_int']['0']
+    similar = similar_ids[offsets[track]:offsets[track + 1]]
+    expected = [str(t) for t in range(149, 149 - MAX_SIMILAR_PER_TRACK, -1)]
+    assert [int_to_id[t] for t in similar] == expected
+
+    engine = RecommendationEngine(**index)
+    assert engine.mix_recommendations('u1', [], 3)[0] == ['149', '148', '147']
+    assert engine.mix_recommendations('u2', ['0'], 3)[0] == ['149', '148']
+
+def test_history_tracks_are_excluded(engine):
+    recommendations, _ = engine.mix_recommendations('u1', ['3', '7', '5'], 10)
+    assert recommendations == ['1', '2', '8', '9']
+
+def test_unknown_history_ids_are_ignored(engine):
+    assert engine.mix_recommendations('u1', ['nope', 'x'], 4) == (
+        ['1', '3', '2', '5'], "online_history + personal"
+    )
+    assert engine.mix_recommendations('u3', ['nope'], 2) == (
+        ['5', '1'], "online_history + top_popular"
+    )
+
+def test_popular_fills_up_to_n(engine):
+    assert engine.mix_recommendations('u2', [], 3) == (['4', '5', '1'], "personal_only")
+    assert engine.mix_recommendations('u3', [], 10) == (
+        ['5', '1', '8', '9'], "top_popular_only"
+    )
+
+@pytest.mark.parametrize("n", [0, -1, -10])
+def test_non_positive_n_returns_nothing(engine, n):
+    assert engine.mix_recommendations('u1', ['1'], n)[0] == []
+    assert engine.mix_recommendations('u3', [], n)[0] == []
+
+def baseline_mix(personal_recs, similar_tracks, top_popular, user_id, online_history, n):
+    """
+    Исходная логика смешивания на датафреймах. Отличие одно, намеренное:
+    популярные добавляются, если после дедупликации и исключения истории
+    рекомендаций меньше n
+    """
+    personal = personal_recs[personal_recs['user_id'] == user_id]
+    personal = personal.sort_values('score', ascending=False).head(n)['track_id'].tolist()
+
+    similar_online = []
+    for track_id in online_history:
+        track_similar = similar_tracks[similar_tracks['track_id'] == track_id]
+        track_similar = track_similar.sort_values('similarity_score', ascending=False)
+        similar_online.extend(track_similar.head(2)['similar_track_id'].tolist())
+
+    seen = set(online_history)
+    recommendations = []
+    sources = [personal, similar_online if online_history else []]
+    for tracks in sources:
+        for track in tracks:
+            if track not in seen:
+                seen.add(track)
+                recommendations.append(track)
+    if len(recommendations) < n:
+        for track in top_popular.head(n * 2)['track_id'].tolist():
+            if track not in seen:
+                seen.add(track)
+                recommendations.append(track)
+
+    if online_history and personal:
+        strategy = "online_history + personal"
+    elif online_history:
+        strategy = "online_history + top_popular"
+    elif personal:
+        strategy = "personal_only"
+    else:
+        strategy = "top_popular_only"
+
+    return recommendations[:n], strategy
+
+def random_dataset(rng):
+    n_tracks = int(rng.integers(1, 30))
+    n_personal = int(rng.integers(0, 40))
+    n_similar = int(rng.integers(0, 60))
+    personal_recs = pd.DataFrame({
+        'user_id': rng.choice(['u0', 'u1', 'u2', 'u3', 'u4'], n_personal),
+        'track_id': rng.integers(0, n_tracks, n_personal),
+        'score': rng.random(n_personal),
+    })
+    similar_tracks = pd.DataFrame({
+        'track_id': rng.integers(0, n_tracks, n_similar),
+        'similar_track_id': rng.integers(0, n_tracks, n_similar),
+        'similarity_score': rng.random(n_similar),
+    })
+    top_popular = pd.DataFrame({
+        'track_id': rng.permutation(n_tracks)[:int(rng.integers(0, 15))]
+    })
+    return personal_recs, similar_tracks, top_popular
+
+def test_matches_baseline_on_random_datasets():
+    rng = np.random.default_rng(42)
+    for _ in range(200):
+        personal_recs, similar_tracks, top_popular = random_dataset(rng)
+        engine = make_engine(personal_recs, similar_tracks, top_popular)
+
+        # Базовая логика работает со строковыми track_id
+        personal_str = personal_recs.astype({'track_id': str})
+        similar_str = similar_tracks.astype({'track_id': str, 'similar_track_id': str})
+        top_popular_str = top_popular.astype({'track_id': str})
+
+        for _ in range(5):
+            user_id = str(rng.choice(['u0', 'u1', 'u2', 'u3', 'u4', 'u5']))
+            online_history = [
+                str(t) for t in rng.integers(0, 35, int(rng.integers(0, 6)))
+            ]
+            n = int(rng.integers(1, 15))
+            assert engine.mix_recommendations(user_id, online_history, n) == baseline_mix(
+                personal_str, similar_str, top_popular_str, user_id, online_history, n
+            )